@@ -1,10 +1,18 @@
 import requests
+import orjson
 import datetime
+import argparse
+import functools
 import os
 import sys
-import json
 import time
 import subprocess
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # =============================================================================
 # WEATHER API SCRIPT FOR POWER BI DASHBOARD
@@ -14,10 +22,6 @@ import subprocess
 # UPDATED: Handles "No moonrise/moonset" cases gracefully
 # =============================================================================
 
-# Configuration
-API_KEY = "345a560d1ab74c239e3171735251109"
-BASE_URL = "http://api.weatherapi.com/v1/forecast.json"
-
 # Your 9 cities for the dashboard
 CITIES = [
     "Bengaluru",
@@ -34,6 +38,74 @@ CITIES = [
 # Directory to save weather data files
 SAVE_DIR = "weather_data"
 
+# Output file for each city, e.g. "New Delhi" -> weather_data/New_Delhi_latest.json
+# Always "latest" - overwritten on each run so Power BI always gets fresh data
+CITY_FILEPATH = {
+    city: os.path.join(SAVE_DIR, city.replace(' ', '_').replace('-', '_') + "_latest.json")
+    for city in CITIES
+}
+
+def _parse_cache_ttl(default=600):
+    """Read CACHE_TTL_SECONDS from the environment, falling back to the default if it isn't a number"""
+    try:
+        return int(os.environ.get("CACHE_TTL_SECONDS", default))
+    except ValueError:
+        print(f"⚠️  Ignoring invalid CACHE_TTL_SECONDS, using {default}s")
+        return default
+
+# Reuse a city's saved forecast instead of calling the API if it is younger than this
+CACHE_TTL_SECONDS = _parse_cache_ttl()
+
+# Serializes per-city log blocks written from worker threads
+_STDOUT_LOCK = threading.Lock()
+
+# Matches the API key query parameter so it can be redacted from logged URLs
+_API_KEY_PARAM = re.compile(r"([?&]key=)[^&\s]+")
+
+# Upper bound on concurrent requests, independent of how many cities there are
+MAX_WORKERS = 16
+
+# Shared HTTP session so every city reuses the same keep-alive connections
+# (pool_maxsize must stay >= the number of worker threads)
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=MAX_WORKERS,
+    pool_maxsize=MAX_WORKERS,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+SESSION.mount("http://", _ADAPTER)
+SESSION.mount("https://", _ADAPTER)
+# No Accept-Encoding override: requests already asks for gzip/deflate (plus
+# br/zstd when those decoders are installed) and decodes transparently
+
+# Top-level sections every valid forecast response must contain
+_REQUIRED_KEYS = frozenset({'location', 'current', 'forecast'})
+
+# Astronomical time fields that might have "No [field]" values, and the
+# placeholder strings the API uses when a time doesn't occur that day
+_TIME_FIELDS = ('moonrise', 'moonset', 'sunrise', 'sunset')
+_MISSING_TIME_VALUES = frozenset({'no moonrise', 'no moonset', 'no sunrise', 'no sunset', 'null', 'none'})
+
+@functools.cache
+def _config():
+    """
+    Load the API configuration from the environment (read and validated once)
+    
+    WEATHER_API_KEY is required; WEATHER_BASE_URL optionally overrides the
+    WeatherAPI forecast endpoint.
+    
+    Returns:
+        SimpleNamespace: api_key and base_url
+    """
+    api_key = os.environ.get("WEATHER_API_KEY", "").strip()
+    if not api_key:
+        raise RuntimeError("WEATHER_API_KEY environment variable is not set")
+    
+    return SimpleNamespace(
+        api_key=api_key,
+        base_url=os.environ.get("WEATHER_BASE_URL", "http://api.weatherapi.com/v1/forecast.json")
+    )
+
 def setup_directory():
     """Create the weather_data directory if it doesn't exist"""
     if not os.path.exists(SAVE_DIR):
@@ -42,178 +114,252 @@ def setup_directory():
     else:
         print(f"📁 Using existing directory: {SAVE_DIR}")
 
+def emit_log(lines):
+    """Write a block of log lines to stdout in one call, without interleaving other threads"""
+    with _STDOUT_LOCK:
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
+
+def redact_api_key(text):
+    """Replace the API key query parameter in a URL or error message"""
+    return _API_KEY_PARAM.sub(r"\1REDACTED", text)
+
 def clean_astronomical_data(astro_data):
     """
-    Clean astronomical data to handle 'No moonrise' and 'No moonset' cases
+    Clean astronomical data in place to handle 'No moonrise' and 'No moonset' cases
     
     Args:
-        astro_data (dict): Astronomical data from API
+        astro_data (dict): Astronomical data from API (modified in place)
     
     Returns:
-        dict: Cleaned astronomical data with null values for missing times
+        int: Number of time fields that were changed to null
     """
-    cleaned_astro = {}
-    
-    # List of time fields that might have "No [field]" values
-    time_fields = ['moonrise', 'moonset', 'sunrise', 'sunset']
+    changed_fields = 0
     
-    for field in time_fields:
-        value = astro_data.get(field, '')
+    for field in _TIME_FIELDS:
+        value = astro_data.get(field)
         
-        # Check if the value indicates no data
-        if (not value or 
-            value.lower().startswith('no ') or 
-            value.lower() in ['no moonrise', 'no moonset', 'no sunrise', 'no sunset', 'null', 'none']):
-            cleaned_astro[field] = None  # Set to null for Power BI
-        else:
-            cleaned_astro[field] = value  # Keep the original time string
-    
-    # Copy other astronomical fields as-is
-    for key, value in astro_data.items():
-        if key not in time_fields:
-            cleaned_astro[key] = value
+        # Check if the value indicates no data ("No moonrise", "null", ...)
+        if value:
+            folded = value.casefold()
+            if folded not in _MISSING_TIME_VALUES and not folded.startswith('no '):
+                continue  # Keep the original time string
+        elif value is None and field in astro_data:
+            continue  # Already null, nothing to change
+        
+        astro_data[field] = None  # Set to null for Power BI
+        changed_fields += 1
     
-    return cleaned_astro
+    return changed_fields
 
-def process_weather_data(raw_data):
+def process_weather_data_inplace(data):
     """
-    Process raw weather data to handle problematic fields
+    Process raw weather data in place to handle problematic fields
     
     Args:
-        raw_data (dict): Raw weather data from API
+        data (dict): Raw weather data from API (modified in place)
     
     Returns:
-        dict: Processed weather data safe for Power BI
+        int: Number of fields that were changed (0 means data is untouched)
     """
-    processed_data = raw_data.copy()
+    changed_fields = 0
     
     # Process forecast days to clean astronomical data
-    if 'forecast' in processed_data and 'forecastday' in processed_data['forecast']:
-        for day in processed_data['forecast']['forecastday']:
+    if 'forecast' in data and 'forecastday' in data['forecast']:
+        for day in data['forecast']['forecastday']:
             if 'astro' in day:
-                day['astro'] = clean_astronomical_data(day['astro'])
+                changed_fields += clean_astronomical_data(day['astro'])
+    
+    return changed_fields
+
+def write_file_atomic(filepath, content):
+    """
+    Write a file so readers never see it half-written
+    
+    The content goes to a temporary file next to the target, which is then
+    renamed over it - os.replace is atomic on both POSIX and NTFS, so Power BI
+    (or a concurrent run) sees either the old file or the new one.
+    
+    Args:
+        filepath (str): Destination path
+        content (bytes): Data to write
+    """
+    tmp_path = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(content)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        # Don't leave stray temp files behind if the write or rename fails
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_cached_weather(filepath):
+    """
+    Load a previously saved forecast if it is still within the cache TTL
+    
+    Args:
+        filepath (str): Path of the city's saved JSON file
+    
+    Returns:
+        dict: Cached weather data, or None if missing, unreadable or stale
+    """
+    if CACHE_TTL_SECONDS <= 0 or not os.path.exists(filepath):
+        return None
+    
+    # Any problem reading or validating the file just means "no cache"
+    try:
+        # Cheap pre-check: a file last written before the TTL window can't be fresh
+        now = time.time()
+        if now - os.stat(filepath).st_mtime >= CACHE_TTL_SECONDS:
+            return None
+        
+        # The mtime alone isn't enough (a fresh git checkout touches every file),
+        # so confirm against the fetch time the API recorded in the payload
+        with open(filepath, 'rb') as file:
+            cached_data = orjson.loads(file.read())
+        fetched_at = cached_data['location']['localtime_epoch']
+        if isinstance(fetched_at, bool) or not isinstance(fetched_at, (int, float)):
+            return None
+        
+        if now - fetched_at >= CACHE_TTL_SECONDS:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
     
-    return processed_data
+    return cached_data
 
-def fetch_weather_for_city(city_name, city_number):
+def fetch_weather_for_city(city_name, city_number, pretty=False):
     """
     Fetch 14-day weather forecast with AQI for a specific city
     
     Args:
         city_name (str): Name of the city
         city_number (int): City number for logging (1-9)
+        pretty (bool): Indent the saved JSON instead of writing it compact
     
     Returns:
         bool: True if successful, False if failed
     """
     
-    # Build the complete API URL
+    filepath = CITY_FILEPATH[city_name]
+    filename = os.path.basename(filepath)
+    
+    # Collect this city's log lines and write them out in one block at the end
+    log = [f"\n[{city_number}/9] 🌤️  Fetching data for: {city_name}"]
+    
+    # Skip the API call entirely if the last fetch is still fresh (--pretty
+    # bypasses the cache so the file is always rewritten indented)
+    cached_data = None if pretty else load_cached_weather(filepath)
+    if cached_data is not None:
+        cache_age = int(time.time() - cached_data['location']['localtime_epoch'])
+        log.append(f"♻️  CACHED: {city_name} (fetched {cache_age}s ago, TTL {CACHE_TTL_SECONDS}s)")
+        log.append(f"   💾 Reusing: {filename}")
+        emit_log(log)
+        return True
+    
+    # Build the API request parameters
+    config = _config()
     params = {
-        "key": API_KEY,
+        "key": config.api_key,
         "q": city_name,
         "days": 14,
         "aqi": "yes",
         "alerts": "no"
     }
     
-    # Create the full URL
-    url = f"{BASE_URL}?key={params['key']}&q={params['q']}&days={params['days']}&aqi={params['aqi']}&alerts={params['alerts']}"
-    
-    print(f"\n[{city_number}/9] 🌤️  Fetching data for: {city_name}")
-    print(f"🔗 API URL: {url}")
-    
     try:
         # Make the API call
-        response = requests.get(BASE_URL, params=params, timeout=30)
+        response = SESSION.get(config.base_url, params=params, timeout=(5, 25))  # (connect, read)
         response.raise_for_status()  # Raise an exception for bad status codes
         
+        # Log the URL requests actually sent, without leaking the API key
+        log.append(f"🔗 API URL: {redact_api_key(response.url)}")
+        
         # Parse JSON to validate it's correct
-        raw_weather_data = response.json()
+        weather_data = orjson.loads(response.content)
         
         # Verify the response has expected structure
-        if 'location' not in raw_weather_data or 'current' not in raw_weather_data or 'forecast' not in raw_weather_data:
-            print(f"❌ Invalid API response structure for {city_name}")
+        if (not isinstance(weather_data, dict)
+                or not _REQUIRED_KEYS.issubset(weather_data.keys())
+                or not isinstance(weather_data['forecast'], dict)
+                or not isinstance(weather_data['forecast'].get('forecastday'), list)):
+            log.append(f"❌ Invalid API response structure for {city_name}")
             return False
         
         # Process the data to handle problematic fields
-        weather_data = process_weather_data(raw_weather_data)
+        changed_fields = process_weather_data_inplace(weather_data)
         
         # Check for and log any cleaned astronomical data
-        forecast_days = weather_data['forecast']['forecastday']
-        cleaned_days = 0
-        for day in forecast_days:
-            if day['astro'].get('moonrise') is None or day['astro'].get('moonset') is None:
-                cleaned_days += 1
+        cleaned_days = sum(
+            1 for day in weather_data['forecast']['forecastday']
+            if (astro := day['astro']).get('moonrise') is None or astro.get('moonset') is None
+        )
         
         if cleaned_days > 0:
-            print(f"🌙 Cleaned {cleaned_days} days with missing moon data for {city_name}")
+            log.append(f"🌙 Cleaned {cleaned_days} days with missing moon data for {city_name}")
         
-        # Get today's date for filename
-        today = datetime.date.today().isoformat()
-        
-        # Create filename that updates daily (overwrites previous)
-        # This ensures Power BI always gets fresh data
-        safe_city_name = city_name.replace(' ', '_').replace('-', '_')
-        filename = f"{safe_city_name}_latest.json"  # Always "latest" - overwrites daily
-        filepath = os.path.join(SAVE_DIR, filename)
+        # Power BI doesn't need indentation, so save compact JSON by default.
+        # Only re-serialize if cleaning changed something (or pretty output
+        # was asked for) - otherwise the response body can be written as-is
+        if pretty:
+            output = orjson.dumps(weather_data, option=orjson.OPT_INDENT_2)
+        elif changed_fields:
+            output = orjson.dumps(weather_data)
+        else:
+            output = response.content
         
-        # Save the processed JSON response with proper formatting
-        with open(filepath, 'w', encoding='utf-8') as file:
-            json.dump(weather_data, file, indent=2, ensure_ascii=False)
+        write_file_atomic(filepath, output)
         
         # Get some basic info for confirmation
         location_name = weather_data['location']['name']
         current_temp = weather_data['current']['temp_c']
         forecast_days_count = len(weather_data['forecast']['forecastday'])
         
-        print(f"✅ SUCCESS: {city_name}")
-        print(f"   📍 Location: {location_name}")
-        print(f"   🌡️  Current Temp: {current_temp}°C")
-        print(f"   📅 Forecast Days: {forecast_days_count}")
-        print(f"   💾 Saved as: {filename}")
+        log.append(f"✅ SUCCESS: {city_name}")
+        log.append(f"   📍 Location: {location_name}")
+        log.append(f"   🌡️  Current Temp: {current_temp}°C")
+        log.append(f"   📅 Forecast Days: {forecast_days_count}")
+        log.append(f"   🗜️  Transfer Encoding: {response.headers.get('Content-Encoding', 'identity')}")
+        log.append(f"   💾 Saved as: {filename}")
         
         return True
         
-    except requests.HTTPError as e:
-        print(f"❌ HTTP Error for {city_name}: {e}")
-        print(f"   Status Code: {e.response.status_code if e.response else 'Unknown'}")
-        return False
-        
-    except requests.ConnectionError as e:
-        print(f"❌ Connection Error for {city_name}: {e}")
-        return False
-        
-    except requests.Timeout as e:
-        print(f"❌ Timeout Error for {city_name}: {e}")
-        return False
-        
-    except requests.RequestException as e:
-        print(f"❌ Request Error for {city_name}: {e}")
-        return False
-        
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON Parse Error for {city_name}: {e}")
+    except (requests.RequestException, ValueError) as e:
+        # Network/HTTP failures and malformed JSON (orjson.JSONDecodeError is a ValueError)
+        log.append(f"❌ {type(e).__name__} for {city_name}: {redact_api_key(str(e))}")
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            log.append(f"   Status Code: {e.response.status_code}")
         return False
         
     except Exception as e:
-        print(f"❌ Unexpected Error for {city_name}: {e}")
+        log.append(f"❌ Unexpected Error for {city_name}: {redact_api_key(str(e))}")
         return False
+        
+    finally:
+        emit_log(log)
 
-def upload_to_github():
+def upload_to_github(run_start=None):
     """
     Optional: Auto-upload to GitHub repository
     Uncomment and configure if you want automatic GitHub upload
+    
+    Args:
+        run_start (datetime.datetime): Start of the run, used for the commit
+            message timestamp (defaults to now)
     """
+    if run_start is None:
+        run_start = datetime.datetime.now()
+    
     try:
-        # Add all files
-        subprocess.run(['git', 'add', '.'], cwd=SAVE_DIR, check=True)
-        
-        # Commit with timestamp
-        commit_message = f"Weather data update - {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
-        subprocess.run(['git', 'commit', '-m', commit_message], cwd=SAVE_DIR, check=True)
+        # Commit with timestamp (only digits, '-', ':' and spaces, so the
+        # double-quoted message is safe in both sh and cmd.exe)
+        commit_message = f"Weather data update - {run_start:%Y-%m-%d %H:%M}"
         
-        # Push to GitHub
-        subprocess.run(['git', 'push'], cwd=SAVE_DIR, check=True)
+        # Add, commit and push in a single shell instead of three git processes
+        command = f'git add . && git commit -m "{commit_message}" && git push'
+        subprocess.run(command, shell=True, cwd=SAVE_DIR, check=True)
         
         print("🚀 Successfully uploaded to GitHub!")
         return True
@@ -221,20 +367,32 @@ def upload_to_github():
         print("⚠️  GitHub upload failed (optional)")
         return False
 
-def main():
-    """Main function to execute the weather data fetching process"""
-    
-    print("=" * 80)
-    print("🌤️  WEATHER DATA FETCHER FOR POWER BI DASHBOARD")
-    print("🌙 UPDATED: Handles 'No moonrise/moonset' cases gracefully")
-    print("=" * 80)
-    print(f"📅 Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"🏙️  Total Cities: {len(CITIES)}")
-    print(f"🔑 API Key: {API_KEY}")
-    print(f"📊 Forecast Days: 14")
-    print(f"🌬️  AQI Included: Yes")
-    print(f"🛡️  Moon Data: Safe handling enabled")
-    print("=" * 80)
+def main(pretty=False):
+    """
+    Main function to execute the weather data fetching process
+    
+    Args:
+        pretty (bool): Save indented, human-readable JSON files
+    """
+    
+    # Take the run's timestamp once and reuse it everywhere it is reported
+    run_start = datetime.datetime.now()
+    
+    log = []
+    log.append("=" * 80)
+    log.append("🌤️  WEATHER DATA FETCHER FOR POWER BI DASHBOARD")
+    log.append("🌙 UPDATED: Handles 'No moonrise/moonset' cases gracefully")
+    log.append("=" * 80)
+    log.append(f"📅 Date: {run_start:%Y-%m-%d %H:%M:%S}")
+    log.append(f"🏙️  Total Cities: {len(CITIES)}")
+    api_key = _config().api_key
+    log.append(f"🔑 API Key: {api_key[:4]}...{api_key[-2:]}")
+    log.append(f"📊 Forecast Days: 14")
+    log.append(f"🌬️  AQI Included: Yes")
+    log.append(f"🛡️  Moon Data: Safe handling enabled")
+    log.append(f"🗂️  Output Format: {'Pretty' if pretty else 'Compact'} JSON")
+    log.append("=" * 80)
+    emit_log(log)
     
     # Setup directory
     setup_directory()
@@ -244,53 +402,70 @@ def main():
     failed_cities = []
     start_time = time.time()
     
-    # Process each city
-    for index, city in enumerate(CITIES, 1):
-        if fetch_weather_for_city(city, index):
-            successful_cities.append(city)
-        else:
-            failed_cities.append(city)
-        
-        # Add a small delay between requests to be respectful to the API
-        if index < len(CITIES):  # Don't sleep after the last request
-            time.sleep(1)  # 1 second delay
+    # Process all cities concurrently - the work is I/O-bound, so threads
+    # let the HTTP requests overlap instead of waiting on each one in turn
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(CITIES))) as executor:
+        futures = {
+            executor.submit(fetch_weather_for_city, city, index, pretty): city
+            for index, city in enumerate(CITIES, 1)
+        }
+        # Collect results in CITIES order so the summary is stable between runs
+        for future, city in futures.items():
+            try:
+                succeeded = future.result()
+            except Exception as e:
+                # One city's failure must never abort the rest of the run
+                emit_log([f"❌ Unexpected Error for {city}: {redact_api_key(str(e))}"])
+                succeeded = False
+            
+            if succeeded:
+                successful_cities.append(city)
+            else:
+                failed_cities.append(city)
     
     # Calculate execution time
     end_time = time.time()
     execution_time = round(end_time - start_time, 2)
     
     # Final Summary
-    print("\n" + "=" * 80)
-    print("📊 EXECUTION SUMMARY")
-    print("=" * 80)
-    print(f"✅ Successful: {len(successful_cities)}/{len(CITIES)} cities")
-    print(f"❌ Failed: {len(failed_cities)}/{len(CITIES)} cities")
-    print(f"⏱️  Execution Time: {execution_time} seconds")
-    print(f"📁 Data Directory: {os.path.abspath(SAVE_DIR)}")
+    log = []
+    log.append("\n" + "=" * 80)
+    log.append("📊 EXECUTION SUMMARY")
+    log.append("=" * 80)
+    log.append(f"✅ Successful: {len(successful_cities)}/{len(CITIES)} cities")
+    log.append(f"❌ Failed: {len(failed_cities)}/{len(CITIES)} cities")
+    log.append(f"⏱️  Execution Time: {execution_time} seconds")
+    log.append(f"📁 Data Directory: {os.path.abspath(SAVE_DIR)}")
     
     if successful_cities:
-        print(f"\n🎉 Successfully fetched data for:")
+        log.append(f"\n🎉 Successfully fetched data for:")
         for city in successful_cities:
-            print(f"   ✓ {city}")
+            log.append(f"   ✓ {city}")
     
     if failed_cities:
-        print(f"\n⚠️  Failed to fetch data for:")
+        log.append(f"\n⚠️  Failed to fetch data for:")
         for city in failed_cities:
-            print(f"   ✗ {city}")
-        print(f"\n💡 Tip: Check your internet connection and API key validity")
+            log.append(f"   ✗ {city}")
+        log.append(f"\n💡 Tip: Check your internet connection and API key validity")
     else:
-        print(f"\n🎉 ALL CITIES PROCESSED SUCCESSFULLY!")
-        print(f"🔄 Your Power BI dashboard can now refresh with the latest data")
-        print(f"🌙 Moon data issues automatically resolved")
+        log.append(f"\n🎉 ALL CITIES PROCESSED SUCCESSFULLY!")
+        log.append(f"🔄 Your Power BI dashboard can now refresh with the latest data")
+        log.append(f"🌙 Moon data issues automatically resolved")
     
-    print("=" * 80)
+    log.append("=" * 80)
+    emit_log(log)
     
     # Return success status for automation scripts
     return len(failed_cities) == 0
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch weather forecasts for the Power BI dashboard")
+    parser.add_argument("--pretty", action="store_true",
+                        help="save indented JSON (useful for debugging; Power BI doesn't need it)")
+    args = parser.parse_args()
+    
     try:
-        success = main()
+        success = main(pretty=args.pretty)
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\n\n⚠️  Script interrupted by user")